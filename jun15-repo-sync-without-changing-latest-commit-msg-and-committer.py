@@ -1,11 +1,15 @@
 import os
+import asyncio
+import base64
 import subprocess
 import shutil
 from github import Github
 from git import Repo
 import json
+import orjson
 import logging
 import time
+import aiohttp
 
 SOURCE_URL = "https://github.com"
 DESTINATION_URL = "https://dev.azure.com"
@@ -17,172 +21,199 @@ DESTINATION_PERSONAL_ACCESS_TOKEN = os.environ["ADO_PERSONAL_ACCESS_TOKEN"]
 RESTRICTED_PREFIX = "restricted"
 ASSET_PREFIX = "asset"
 LOCAL_PATH = os.environ["RUNNER_TEMP"]
+MAX_CONCURRENT_CLONES = 16
+MAX_CONCURRENT_CREATES = 8
+DESTINATION_CREDENTIALS = base64.b64encode(
+    f":{DESTINATION_PERSONAL_ACCESS_TOKEN}".encode()
+).decode()
+# Use the v2 wire protocol, and authenticate to ADO through a header so the
+# token stays out of the git command lines
+GIT_ENV = {
+    **os.environ,
+    "GIT_CONFIG_COUNT": "2",
+    "GIT_CONFIG_KEY_0": "protocol.version",
+    "GIT_CONFIG_VALUE_0": "2",
+    "GIT_CONFIG_KEY_1": f"http.{DESTINATION_URL}/.extraHeader",
+    "GIT_CONFIG_VALUE_1": f"Authorization: Basic {DESTINATION_CREDENTIALS}",
+}
+
+# Reuse one GitHub client for every API call
+GITHUB_CLIENT = Github(PERSONAL_ACCESS_TOKEN, per_page=100, retry=3)
 
 logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 
 
-def create_ado_repository(org_name: str, project_name: str, repo_name: str) -> None:
+async def create_ado_repository(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    org_name: str,
+    project_name: str,
+    repo_name: str,
+) -> None:
     # Replace period at beginning of repo_name with underscore
     if repo_name.startswith("."):
         repo_name = "_" + repo_name[1:]
     # Create the repository
-    cmd = [
-        "az",
-        "repos",
-        "create",
-        "--org",
-        f"https://dev.azure.com/{org_name}",
-        "--project",
-        project_name,
-        "--name",
-        repo_name,
-        "--output",
-        "table",
-    ]
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error creating repository {repo_name}: {e}")
-
-
-def list_ado_repositories(org_name: str, project_name: str) -> list:
-    destination_repos = []
-    cmd = (
-        f"az repos list --org https://dev.azure.com/{org_name} --project {project_name}"
-    )
-    output = os.popen(cmd).read()
-    repos = json.loads(output)
+    url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
+    data = {"name": repo_name}
+    async with semaphore:
+        try:
+            async with session.post(url, data=json.dumps(data)) as response:
+                response.raise_for_status()
+        except aiohttp.ClientError as e:
+            logging.error(f"Error creating repository {repo_name}: {e}")
+
+
+async def list_ado_repositories(
+    session: aiohttp.ClientSession, org_name: str, project_name: str
+) -> set:
+    destination_repos = set()
+    url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
+    async with session.get(url) as response:
+        response.raise_for_status()
+        repos = orjson.loads(await response.read())["value"]
     for repo in repos:
-        destination_repos.append(repo["name"])
+        destination_repos.add(repo["name"])
     return destination_repos
 
 
-def get_default_branch(repo_name: str) -> str:
-    g = Github(PERSONAL_ACCESS_TOKEN)
-    repo = g.get_repo(f"{SOURCE_USER}/{repo_name}")
-    return repo.default_branch
-
-
-def clone_and_push(repo_name: str) -> tuple:
-    try:
-        logging.info(f"Cloning repo: {repo_name} started.")
-        default_branch = get_default_branch(repo_name)
+def list_github_repositories() -> list:
+    # Get all repositories from GitHub except repos starting with restricted prefix
+    source_repos = GITHUB_CLIENT.get_user().get_repos()
+    return [
+        repo
+        for repo in source_repos
+        if not repo.name.startswith(RESTRICTED_PREFIX) and repo.name.startswith("pet")
+    ]
 
-        # Clone the repository with a depth of 1 and without checkout
-        clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
-        repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
 
-        # Check if repo_path already exists and is not empty
-        if os.path.exists(repo_path) and os.listdir(repo_path):
-            # Delete the existing directory and its contents
-            shutil.rmtree(repo_path)
+async def run_command(*args: str) -> None:
+    process = await asyncio.create_subprocess_exec(*args, env=GIT_ENV)
+    returncode = await process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
 
-        subprocess.run(
-            ["git", "clone", "--no-checkout", "--depth", "1", clone_url, repo_path],
-            check=True,
-        )
 
-        # Change to the cloned repository directory
-        os.chdir(repo_path)
+async def clone_and_push(
+    intermediaries: asyncio.Queue, repo_name: str, default_branch: str
+) -> tuple:
+    # Taking a bare intermediary repository from the pool also bounds the number
+    # of clones running at once
+    repo_path = await intermediaries.get()
+    try:
+        logging.info(f"Cloning repo: {repo_name} started.")
 
-        # Fetch the latest commit from the default branch
-        subprocess.run(
-            ["git", "fetch", "origin", default_branch],
-            check=True,
-        )
+        if not os.path.exists(repo_path):
+            await run_command("git", "init", "--bare", "--quiet", repo_path)
 
-        # Create a new branch for Azure DevOps
-        azure_devops_branch = "azure-devops-branch"
-        subprocess.run(
-            ["git", "checkout", "-b", azure_devops_branch],
-            check=True,
+        # Fetch only the latest commit of the default branch, without a working tree
+        clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
+        await run_command(
+            "git", "-C", repo_path, "fetch", "--depth", "1", clone_url, default_branch
         )
 
-        # Add the Azure DevOps remote URL
-        remote_name = "destination"
+        # Push the fetched commit straight to Azure DevOps
         remote_url = f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
-        remote_url_with_token = remote_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
-        )
-        subprocess.run(
-            ["git", "remote", "add", remote_name, remote_url_with_token],
-            check=True,
-        )
-
-        # Push the new branch to Azure DevOps
-        subprocess.run(
-            [
-                "git",
-                "push",
-                "--force",
-                remote_name,
-                f"{azure_devops_branch}:refs/heads/{default_branch}",
-            ],
-            check=True,
+        await run_command(
+            "git",
+            "-C",
+            repo_path,
+            "push",
+            "--force",
+            remote_url,
+            f"FETCH_HEAD:refs/heads/{default_branch}",
         )
-        # Clean up
-        os.chdir("..")
-        shutil.rmtree(repo_path)
         logging.info(f"Cloning repo: {repo_name} complete.")
         return (repo_name, None)
     except Exception as e:
         return (repo_name, e)
+    finally:
+        intermediaries.put_nowait(repo_path)
+
+
+async def create_and_push(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    intermediaries: asyncio.Queue,
+    repo_name: str,
+    default_branch: str,
+) -> tuple:
+    await create_ado_repository(
+        session, semaphore, DESTINATION_ORG, DESTINATION_PROJECT, repo_name
+    )
+    return await clone_and_push(intermediaries, repo_name, default_branch)
 
 
-def synchronize_repository(repo_name):
-    result = clone_and_push(repo_name)
-    if result is not None:
-        repo_name, error = result
-        if error:
-            print(
-                f"Error: Task failed with exception: {error} for repository: {repo_name}"
-            )
-
-
-def main():
+async def main():
     start_time = time.time()
     logging.info(f"Started cloning/syncing at {start_time}")
 
-    g = Github(PERSONAL_ACCESS_TOKEN)
-
-    # Get all repositories from GitHub except repos starting with restricted prefix
-    source_repos = g.get_user().get_repos()
-    source_repos = [
-        repo
-        for repo in source_repos
-        if not repo.name.startswith(RESTRICTED_PREFIX) and repo.name.startswith("pet")
-    ]
-    logging.info(f"{len(source_repos)} repositories found in GitHub.")
-
-    # Get all repositories from destination platform
-    destination_repos = list_ado_repositories(DESTINATION_ORG, DESTINATION_PROJECT)
-    logging.info(f"{len(destination_repos)} repositories found in ADO.")
-
-    # Find new repositories on GitHub that do not exist on destination platform
-    new_repos = [repo for repo in source_repos if repo.name not in destination_repos]
-
-    # Create new repositories on destination platform and push changes from Github
-    logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
-
-    for repo in new_repos:
-        create_ado_repository(DESTINATION_ORG, DESTINATION_PROJECT, repo.name)
-        synchronize_repository(repo.name)
-
-    # Pull latest changes from main/master branch of existing repositories and push to destination platform
-    existing_repos = [repo for repo in source_repos if repo.name in destination_repos]
-    logging.info(
-        f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub."
-    )
-
-    for repo in existing_repos:
-        synchronize_repository(repo.name)
+    async with aiohttp.ClientSession(
+        auth=aiohttp.BasicAuth("", DESTINATION_PERSONAL_ACCESS_TOKEN),
+        headers={"Content-Type": "application/json"},
+    ) as session:
+        # List both platforms at once; PyGithub is synchronous, so it runs in a thread
+        source_repos, destination_repos = await asyncio.gather(
+            asyncio.to_thread(list_github_repositories),
+            list_ado_repositories(session, DESTINATION_ORG, DESTINATION_PROJECT),
+        )
+        logging.info(f"{len(source_repos)} repositories found in GitHub.")
+        logging.info(f"{len(destination_repos)} repositories found in ADO.")
+        default_branches = {repo.name: repo.default_branch for repo in source_repos}
+
+        # Find new repositories on GitHub that do not exist on destination platform
+        new_repos = [
+            repo for repo in source_repos if repo.name not in destination_repos
+        ]
+        logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
+
+        # Pull latest changes from main/master branch of existing repositories and push to destination platform
+        existing_repos = [
+            repo for repo in source_repos if repo.name in destination_repos
+        ]
+        logging.info(
+            f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub."
+        )
 
-    exec_time = time.gmtime(time.time() - start_time)
+        # Bound the in-flight create requests to stay within ADO rate limits
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+        intermediaries = asyncio.Queue()
+        for i in range(MAX_CONCURRENT_CLONES):
+            intermediaries.put_nowait(f"{LOCAL_PATH}/tempdir/intermediary-{i}.git")
+
+        # New repositories are cloned as soon as their own create finishes, while
+        # existing repositories are synchronized alongside them
+        tasks = [
+            create_and_push(
+                session,
+                semaphore,
+                intermediaries,
+                repo.name,
+                default_branches[repo.name],
+            )
+            for repo in new_repos
+        ]
+        tasks += [
+            clone_and_push(intermediaries, repo.name, default_branches[repo.name])
+            for repo in existing_repos
+        ]
+        for task in asyncio.as_completed(tasks):
+            repo_name, error = await task
+            if error:
+                print(
+                    f"Error: Task failed with exception: {error} for repository: {repo_name}"
+                )
+
+    # Clean up the intermediary repositories
+    shutil.rmtree(f"{LOCAL_PATH}/tempdir", ignore_errors=True)
+
+    exec_hours, exec_seconds = divmod(int(time.time() - start_time), 3600)
+    exec_minutes, exec_seconds = divmod(exec_seconds, 60)
 
     logging.info(
-        f"Synchronization time: {exec_time.tm_hour}h {exec_time.tm_min}m {exec_time.tm_sec}s"
+        f"Synchronization time: {exec_hours}h {exec_minutes}m {exec_seconds}s"
     )
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
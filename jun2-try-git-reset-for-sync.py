@@ -1,12 +1,13 @@
 import os
+import asyncio
+import base64
 import subprocess
-import shutil
 from github import Github
-from git import Repo
 import json
-from concurrent.futures import ThreadPoolExecutor
+import orjson
 import logging
 import time
+import aiohttp
 
 SOURCE_URL = "https://github.com"
 DESTINATION_URL = "https://dev.azure.com"
@@ -18,199 +19,233 @@ DESTINATION_PERSONAL_ACCESS_TOKEN = os.environ["ADO_PERSONAL_ACCESS_TOKEN"]
 RESTRICTED_PREFIX = "restricted"
 ASSET_PREFIX = "asset"
 LOCAL_PATH = os.environ["RUNNER_TEMP"]
+MIRROR_PATH = os.path.join(os.path.dirname(LOCAL_PATH), "cache", "mirrors")
+MAX_CONCURRENT_SYNCS = 16
+MAX_CONCURRENT_CREATES = 8
+DESTINATION_CREDENTIALS = base64.b64encode(
+    f":{DESTINATION_PERSONAL_ACCESS_TOKEN}".encode()
+).decode()
+# Authenticate to ADO through a header so the token stays out of the git command lines
+GIT_ENV = {
+    **os.environ,
+    "GIT_CONFIG_COUNT": "1",
+    "GIT_CONFIG_KEY_0": f"http.{DESTINATION_URL}/.extraHeader",
+    "GIT_CONFIG_VALUE_0": f"Authorization: Basic {DESTINATION_CREDENTIALS}",
+}
+
+# Reuse one GitHub client for every API call
+GITHUB_CLIENT = Github(PERSONAL_ACCESS_TOKEN, per_page=100, retry=3)
 
 logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.DEBUG)
 
 
-def create_ado_repository(org_name: str, project_name: str, repo_name: str) -> None:
+def ado_repository_name(repo_name: str) -> str:
     # Replace period at beginning of repo_name with underscore
     if repo_name.startswith("."):
-        repo_name = "_" + repo_name[1:]
+        return "_" + repo_name[1:]
+    return repo_name
+
+
+async def create_ado_repository(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    org_name: str,
+    project_name: str,
+    repo_name: str,
+) -> None:
+    repo_name = ado_repository_name(repo_name)
     # Create the repository
-    cmd = [
-        "az",
-        "repos",
-        "create",
-        "--org",
-        f"https://dev.azure.com/{org_name}",
-        "--project",
-        project_name,
-        "--name",
-        repo_name,
-        "--output",
-        "table",
-    ]
-    try:
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error creating repository {repo_name}: {e}")
-
-
-def list_ado_repositories(org_name: str, project_name: str) -> list:
-    destination_repos = []
-    cmd = (
-        f"az repos list --org https://dev.azure.com/{org_name} --project {project_name}"
-    )
-    output = os.popen(cmd).read()
-    repos = json.loads(output)
+    url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
+    data = {"name": repo_name}
+    async with semaphore:
+        try:
+            async with session.post(url, data=json.dumps(data)) as response:
+                response.raise_for_status()
+        except aiohttp.ClientError as e:
+            logging.error(f"Error creating repository {repo_name}: {e}")
+
+
+async def list_ado_repositories(
+    session: aiohttp.ClientSession, org_name: str, project_name: str
+) -> set:
+    destination_repos = set()
+    url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
+    async with session.get(url) as response:
+        response.raise_for_status()
+        repos = orjson.loads(await response.read())["value"]
     for repo in repos:
-        destination_repos.append(repo["name"])
+        destination_repos.add(repo["name"])
     return destination_repos
 
 
-def get_default_branch(repo_name: str) -> str:
-    g = Github(PERSONAL_ACCESS_TOKEN)
-    repo = g.get_repo(f"{SOURCE_USER}/{repo_name}")
-    return repo.default_branch
-
-
-def clone_and_push(repo_name: str) -> tuple:
-    try:
-        logging.info(f"Cloning repo: {repo_name} started.")
-        default_branch = get_default_branch(repo_name)
-        logging.debug(f"Default branch for repo {repo_name}: {default_branch}")
-
-        if default_branch is None:
-            logging.info(f"Skipping empty repo: {repo_name}")
-            return (repo_name, None)
-
-        # Clone the repository without depth
-        clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
-        repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
+def list_github_repositories() -> list:
+    # Get all repositories from GitHub except repos starting with restricted prefix
+    source_repos = GITHUB_CLIENT.get_user().get_repos()
+    return [
+        repo
+        for repo in source_repos
+        if not repo.name.startswith(RESTRICTED_PREFIX) and repo.name.startswith("skill")
+    ]
 
-        if os.path.exists(repo_path):
-            shutil.rmtree(repo_path)
 
-        repo = Repo.clone_from(clone_url, repo_path, branch=default_branch)
+async def run_command(*args: str) -> None:
+    process = await asyncio.create_subprocess_exec(*args, env=GIT_ENV)
+    returncode = await process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
 
-        # Reset the repository to remove commit history
-        repo.git.reset("--hard", default_branch)
 
-        # Push to destination
-        remote_name = "destination"
-        remote_url = f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
-        remote_url_with_token = remote_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
+async def update_mirror(repo_name: str) -> str:
+    # Reuse the cached bare mirror, or create it on the first run
+    source_clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
+    mirror_path = f"{MIRROR_PATH}/{repo_name}.git"
+    if not os.path.exists(mirror_path):
+        await run_command("git", "init", "--bare", "--quiet", mirror_path)
+        # Mirror branches and tags only
+        await run_command(
+            "git", "-C", mirror_path, "config", "remote.origin.url", source_clone_url
         )
-
-        repo.create_remote(remote_name, url=remote_url_with_token)
-        repo.git.push(remote_name, f"HEAD:refs/heads/{default_branch}", force=True)
-
-        # Clean up
-        shutil.rmtree(repo_path)
-        logging.info(f"Cloning repo: {repo_name} complete.")
-        return (repo_name, None)
-    except Exception as e:
-        return (repo_name, e)
-
-
-def synchronize_and_push(repo_name: str) -> tuple:
-    try:
-        logging.info(f"Synchronization of repo: {repo_name} started.")
-        default_branch = get_default_branch(repo_name)
-        # Set up source and destination repository URLs
-        source_clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
-        # Replace period at beginning of repo_name with underscore
-        if repo_name.startswith("."):
-            repo_name = "_" + repo_name[1:]
-        destination_clone_url = f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
-        destination_clone_url_with_token = destination_clone_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
+        await run_command(
+            "git",
+            "-C",
+            mirror_path,
+            "config",
+            "remote.origin.fetch",
+            "+refs/heads/*:refs/heads/*",
         )
-
-        # Set up temporary repository path
-        tmp_repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
-        if os.path.exists(tmp_repo_path):
-            shutil.rmtree(tmp_repo_path)
-
-        # Clone source repository
-        tmp_repo = Repo.clone_from(
-            source_clone_url, tmp_repo_path, branch=default_branch, depth=1
+        await run_command(
+            "git",
+            "-C",
+            mirror_path,
+            "config",
+            "--add",
+            "remote.origin.fetch",
+            "+refs/tags/*:refs/tags/*",
         )
+    await run_command("git", "-C", mirror_path, "fetch", "--prune", "origin")
 
-        # Pull LFS objects
-        tmp_repo.git.lfs("pull")
-
-        # Remove history and initialize new repository
-        shutil.rmtree(os.path.join(tmp_repo_path, ".git"))
-        tmp_repo = Repo.init(tmp_repo_path)
-
-        # Make an initial commit
-        tmp_repo.git.add(A=True)
-        tmp_repo.index.commit("Update from GitHub")
+    # Fetch LFS objects
+    await run_command("git", "-C", mirror_path, "lfs", "fetch", "--all", "origin")
+    return mirror_path
 
-        # Add destination remote
-        tmp_repo.create_remote("destination", url=destination_clone_url_with_token)
-
-        # Push changes to destination
-        tmp_repo.remotes.destination.push(
-            f"HEAD:refs/heads/{default_branch}", force=True
-        )
 
-        # Clean up
-        shutil.rmtree(tmp_repo_path)
-        logging.info(f"Synchronization of repo: {repo_name} complete.")
-        return (repo_name, None)
-    except Exception as e:
-        return (repo_name, e)
+async def push_mirror(mirror_path: str, destination_url: str) -> None:
+    # Push LFS objects first, so the pushed refs never point at missing content
+    await run_command(
+        "git", "-C", mirror_path, "lfs", "push", "--all", destination_url
+    )
+    await run_command(
+        "git", "-C", mirror_path, "push", "--mirror", "--force", destination_url
+    )
 
 
-def main():
-    start_time = time.time()
-    logging.debug(f"Started cloning/syncing at {start_time}")
+async def mirror_and_push(
+    semaphore: asyncio.Semaphore, repo_name: str, default_branch: str
+) -> tuple:
+    async with semaphore:
+        try:
+            logging.info(f"Mirroring repo: {repo_name} started.")
+            logging.debug(f"Default branch for repo {repo_name}: {default_branch}")
 
-    g = Github(PERSONAL_ACCESS_TOKEN)
+            if default_branch is None:
+                logging.info(f"Skipping empty repo: {repo_name}")
+                return (repo_name, None)
 
-    # Get all repositories from GitHub except repos starting with restricted prefix
-    source_repos = g.get_user().get_repos()
-    source_repos = [
-        repo
-        for repo in source_repos
-        if not repo.name.startswith(RESTRICTED_PREFIX) and repo.name.startswith("skill")
-    ]
-    logging.info(f"{len(source_repos)} repositories found in GitHub.")
+            mirror_path = await update_mirror(repo_name)
 
-    # Get all repositories from destination platform
-    destination_repos = list_ado_repositories(DESTINATION_ORG, DESTINATION_PROJECT)
-    logging.info(f"{len(destination_repos)} repositories found in ADO.")
+            # Push every branch and tag to destination
+            destination_name = ado_repository_name(repo_name)
+            remote_url = f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{destination_name}"
+            await push_mirror(mirror_path, remote_url)
 
-    # Find new repositories on GitHub that do not exist on destination platform
-    new_repos = [repo for repo in source_repos if repo.name not in destination_repos]
+            logging.info(f"Mirroring repo: {repo_name} complete.")
+            return (repo_name, None)
+        except Exception as e:
+            return (repo_name, e)
+
+
+async def create_and_push(
+    session: aiohttp.ClientSession,
+    create_semaphore: asyncio.Semaphore,
+    sync_semaphore: asyncio.Semaphore,
+    repo_name: str,
+    default_branch: str,
+) -> tuple:
+    await create_ado_repository(
+        session, create_semaphore, DESTINATION_ORG, DESTINATION_PROJECT, repo_name
+    )
+    return await mirror_and_push(sync_semaphore, repo_name, default_branch)
 
-    # Create new repositories on destination platform and push changes from Github
-    logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
 
-    for repo in new_repos:
-        create_ado_repository(DESTINATION_ORG, DESTINATION_PROJECT, repo.name)
-        result = clone_and_push(repo.name)
-        if result is not None:
-            repo_name, error = result
-            if error:
-                print(
-                    f"Error: Task failed with exception: {error} for repository: {repo_name}"
-                )
+async def main():
+    start_time = time.time()
+    logging.debug(f"Started cloning/syncing at {start_time}")
 
-    # Pull latest changes from main/master branch of existing repositories and push to destination platform
-    existing_repos = [repo for repo in source_repos if repo.name in destination_repos]
-    logging.info(
-        f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub."
-    )
+    async with aiohttp.ClientSession(
+        auth=aiohttp.BasicAuth("", DESTINATION_PERSONAL_ACCESS_TOKEN),
+        headers={"Content-Type": "application/json"},
+    ) as session:
+        # List both platforms at once; PyGithub is synchronous, so it runs in a thread
+        source_repos, destination_repos = await asyncio.gather(
+            asyncio.to_thread(list_github_repositories),
+            list_ado_repositories(session, DESTINATION_ORG, DESTINATION_PROJECT),
+        )
+        logging.info(f"{len(source_repos)} repositories found in GitHub.")
+        logging.info(f"{len(destination_repos)} repositories found in ADO.")
+        default_branches = {repo.name: repo.default_branch for repo in source_repos}
+
+        # Find new repositories on GitHub that do not exist on destination platform
+        new_repos = [
+            repo
+            for repo in source_repos
+            if ado_repository_name(repo.name) not in destination_repos
+        ]
+        logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
+
+        # Pull latest changes from existing repositories and push to destination platform
+        existing_repos = [
+            repo
+            for repo in source_repos
+            if ado_repository_name(repo.name) in destination_repos
+        ]
+        logging.info(
+            f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub."
+        )
 
-    for repo in existing_repos:
-        result = synchronize_and_push(repo.name)
-        if result is not None:
-            repo_name, error = result
+        # Bound the in-flight create requests to stay within ADO rate limits
+        create_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+        sync_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SYNCS)
+
+        # New repositories are mirrored as soon as their own create finishes, while
+        # existing repositories are synchronized alongside them
+        tasks = [
+            create_and_push(
+                session,
+                create_semaphore,
+                sync_semaphore,
+                repo.name,
+                default_branches[repo.name],
+            )
+            for repo in new_repos
+        ]
+        tasks += [
+            mirror_and_push(sync_semaphore, repo.name, default_branches[repo.name])
+            for repo in existing_repos
+        ]
+        for task in asyncio.as_completed(tasks):
+            repo_name, error = await task
             if error:
                 print(
                     f"Error: Task failed with exception: {error} for repository: {repo_name}"
                 )
 
-    exec_time = time.gmtime(time.time() - start_time)
+    exec_hours, exec_seconds = divmod(int(time.time() - start_time), 3600)
+    exec_minutes, exec_seconds = divmod(exec_seconds, 60)
 
-    sync_time = f"Synchronization time: {exec_time.tm_hour}h {exec_time.tm_min}m {exec_time.tm_sec}s"
+    sync_time = f"Synchronization time: {exec_hours}h {exec_minutes}m {exec_seconds}s"
     logging.info(sync_time)
     print(sync_time, file=open("$GITHUB_OUTPUT", "a"))
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,13 +1,13 @@
 import os
-import shutil
+import asyncio
+import base64
+import subprocess
 from github import Github
-from git import Repo
 import json
-from concurrent.futures import ThreadPoolExecutor
+import orjson
 import logging
 import time
-import requests
-from requests.auth import HTTPBasicAuth
+import aiohttp
 
 SOURCE_URL = "https://github.com"
 DESTINATION_URL = "https://dev.azure.com"
@@ -19,235 +19,175 @@ DESTINATION_PERSONAL_ACCESS_TOKEN = os.environ['ADO_PERSONAL_ACCESS_TOKEN']
 RESTRICTED_PREFIX = "restricted"
 ASSET_PREFIX = "asset"
 LOCAL_PATH = os.environ['RUNNER_TEMP']
+MIRROR_PATH = os.path.join(os.path.dirname(LOCAL_PATH), "cache", "mirrors")
+MAX_CONCURRENT_SYNCS = 16
+MAX_CONCURRENT_CREATES = 8
+DESTINATION_CREDENTIALS = base64.b64encode(
+    f":{DESTINATION_PERSONAL_ACCESS_TOKEN}".encode()
+).decode()
+# Authenticate to ADO through a header so the token stays out of the git command lines
+GIT_ENV = {
+    **os.environ,
+    "GIT_CONFIG_COUNT": "1",
+    "GIT_CONFIG_KEY_0": f"http.{DESTINATION_URL}/.extraHeader",
+    "GIT_CONFIG_VALUE_0": f"Authorization: Basic {DESTINATION_CREDENTIALS}",
+}
+
+# Reuse one GitHub client for every API call
+GITHUB_CLIENT = Github(PERSONAL_ACCESS_TOKEN, per_page=100, retry=3)
 
 logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 
 
-def create_ado_repository(org_name: str, project_name: str, repo_name: str) -> None:
+async def create_ado_repository(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    org_name: str,
+    project_name: str,
+    repo_name: str,
+) -> None:
     url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
     data = {"name": repo_name}
-    headers = {"Content-Type": "application/json"}
-    response = requests.post(
-        url,
-        data=json.dumps(data),
-        headers=headers,
-        auth=HTTPBasicAuth("", DESTINATION_PERSONAL_ACCESS_TOKEN),
-    )
-    response.raise_for_status()
+    async with semaphore:
+        async with session.post(url, data=json.dumps(data)) as response:
+            response.raise_for_status()
 
 
-def list_ado_repositories(org_name: str, project_name: str) -> list:
-    destination_repos = []
+async def list_ado_repositories(
+    session: aiohttp.ClientSession, org_name: str, project_name: str
+) -> set:
+    destination_repos = set()
     url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
-    headers = {"Content-Type": "application/json"}
-    response = requests.get(
-        url, headers=headers, auth=HTTPBasicAuth("", DESTINATION_PERSONAL_ACCESS_TOKEN)
-    )
-    response.raise_for_status()
-    repos = json.loads(response.text)["value"]
+    async with session.get(url) as response:
+        response.raise_for_status()
+        repos = orjson.loads(await response.read())["value"]
     for repo in repos:
-        destination_repos.append(repo["name"])
+        destination_repos.add(repo["name"])
     return destination_repos
 
 
-def get_default_branch(repo_name: str) -> str:
-    g = Github(PERSONAL_ACCESS_TOKEN)
-    repo = g.get_repo(f"{SOURCE_USER}/{repo_name}")
-    return repo.default_branch
-
+def list_github_repositories() -> list:
+    # Get all repositories from GitHub except repos starting with restricted prefix
+    source_repos = GITHUB_CLIENT.get_user().get_repos()
+    return [
+        repo for repo in source_repos if not repo.name.startswith(RESTRICTED_PREFIX)
+        and repo.name.startswith("t")
+    ]
 
-def clone_and_push(repo_name: str) -> tuple:
-    try:
-        logging.info(f'Cloning repo: {repo_name} started.')
-        default_branch = get_default_branch(repo_name)
-
-        # Clone only the latest version of the default branch from Github
-        clone_url = f'{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git'
-        repo_path = f'{LOCAL_PATH}/tempdir/{repo_name}'
-
-        # Check if repo_path already exists and is not empty
-        if os.path.exists(repo_path) and os.listdir(repo_path):
-            # Delete the existing directory and its contents
-            shutil.rmtree(repo_path)
-
-        repo = Repo.clone_from(clone_url, repo_path,
-                            branch=default_branch, depth=1)
-
-        # Remove history and initi
-        os.system(f'cd {repo_path} && rm -rf .git && git init')
-
-        # Make an initial commit
-        repo.index.add("*")
-
-        hidden_files = [file for file in repo.untracked_files if file.startswith('.')]
-        if hidden_files:
-            repo.index.add(hidden_files)
-        else:
-            print("No hidden files found")
-        repo.index.commit("Initial commit")
-
-        # Push to destination
-        remote_name = 'destination'
-        remote_url = f'{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}'
-        remote_url_with_token = remote_url.replace(
-            'https://', f'https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@')
-        repo.create_remote(remote_name, url=remote_url_with_token)
-        repo.git.push(remote_name, f'HEAD:refs/heads/{default_branch}', force=True)
-
-        # Clean up
-        os.system(f'rm -rf {repo_path}')
-        logging.info(f'Cloning repo: {repo_name} complete.')
-        return (repo_name, None)
-    except Exception as e:
-        return (repo_name, e)
 
+async def run_command(*args: str) -> None:
+    process = await asyncio.create_subprocess_exec(*args, env=GIT_ENV)
+    returncode = await process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
 
-def synchronize_and_push(repo_name: str) -> tuple:
-    try:
-        logging.info(f'Synchronization of repo: {repo_name} started.')
-        default_branch = get_default_branch(repo_name)
 
-        # Set up source and destination repository URLs
-        source_clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
-        destination_clone_url = (
-            f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
-        )
-        destination_clone_url_with_token = destination_clone_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
+async def update_mirror(repo_name: str) -> str:
+    # Reuse the cached bare mirror, or create it on the first run
+    source_clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
+    mirror_path = f"{MIRROR_PATH}/{repo_name}.git"
+    if not os.path.exists(mirror_path):
+        await run_command("git", "init", "--bare", "--quiet", mirror_path)
+        # Mirror branches and tags only
+        await run_command(
+            "git", "-C", mirror_path, "config", "remote.origin.url", source_clone_url
         )
-
-        # Set up temporary repository path
-        tmp_repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
-        if os.path.exists(tmp_repo_path):
-            shutil.rmtree(tmp_repo_path)
-
-        # Clone source repository
-        Repo.clone_from(source_clone_url, tmp_repo_path, branch=default_branch, depth=1)
-
-        # Remove history and initialize new repository
-        shutil.rmtree(os.path.join(tmp_repo_path, ".git"))
-        tmp_repo = Repo.init(tmp_repo_path)
-
-        # Make an initial commit
-        tmp_repo.git.add(A=True)
-        tmp_repo.index.commit("Update from GitHub")
-
-        # Add destination remote
-        tmp_repo.create_remote("destination", url=destination_clone_url_with_token)
-
-        # Push changes to destination
-        tmp_repo.remotes.destination.push(f"HEAD:refs/heads/{default_branch}", force=True)
-
-        # Clean up
-        shutil.rmtree(tmp_repo_path)
-        logging.info(f'Synchronization of repo: {repo_name} complete.')
-        return (repo_name, None)
-    except Exception as e:
-        return (repo_name, e)
-
-
-def synchronize_and_push(repo_name: str) -> tuple:
-    logging.info(f'Synchronization of repo: {repo_name} started.')
-    try:
-        default_branch = get_default_branch(repo_name)
-
-        # Set up source and destination repository URLs
-        source_clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
-        destination_clone_url = (
-            f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
+        await run_command(
+            "git", "-C", mirror_path, "config",
+            "remote.origin.fetch", "+refs/heads/*:refs/heads/*"
         )
-        destination_clone_url_with_token = destination_clone_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
+        await run_command(
+            "git", "-C", mirror_path, "config", "--add",
+            "remote.origin.fetch", "+refs/tags/*:refs/tags/*"
         )
+    await run_command("git", "-C", mirror_path, "fetch", "--prune", "origin")
+    return mirror_path
 
-        # Set up temporary repository path
-        tmp_repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
-        if os.path.exists(tmp_repo_path):
-            shutil.rmtree(tmp_repo_path)
 
-        # Clone source repository
-        Repo.clone_from(source_clone_url, tmp_repo_path, branch=default_branch, depth=1)
+async def mirror_and_push(semaphore: asyncio.Semaphore, repo_name: str) -> tuple:
+    async with semaphore:
+        try:
+            logging.info(f'Mirroring repo: {repo_name} started.')
+            mirror_path = await update_mirror(repo_name)
 
-        # Add destination remote
-        tmp_repo = Repo(tmp_repo_path)
-        tmp_repo.create_remote("destination", url=destination_clone_url_with_token)
+            # Push every branch and tag to destination
+            remote_url = f'{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}'
+            await run_command(
+                "git", "-C", mirror_path, "push", "--mirror", "--force", remote_url
+            )
 
-        # Pull changes from destination repository
-        try:
-            tmp_repo.remotes.destination.pull(default_branch)
+            logging.info(f'Mirroring repo: {repo_name} complete.')
+            return (repo_name, None)
         except Exception as e:
-            logging.warning(f"Failed to pull changes from destination repository: {e}")
+            return (repo_name, e)
 
-        # Push changes to destination
-        tmp_repo.remotes.destination.push(f"HEAD:refs/heads/{default_branch}", force=True)
 
-        # Clean up
-        shutil.rmtree(tmp_repo_path)
-        return (repo_name, None)
-        
-    except Exception as e:
+async def create_and_push(
+    session: aiohttp.ClientSession,
+    create_semaphore: asyncio.Semaphore,
+    sync_semaphore: asyncio.Semaphore,
+    repo_name: str,
+) -> tuple:
+    try:
+        await create_ado_repository(
+            session, create_semaphore, DESTINATION_ORG, DESTINATION_PROJECT, repo_name
+        )
+    except aiohttp.ClientError as e:
         return (repo_name, e)
-    
+    return await mirror_and_push(sync_semaphore, repo_name)
+
 
-def main():
+async def main():
     start_time = time.time()
     logging.debug(f"Started cloning/syncing at {start_time}")
 
-    g = Github(PERSONAL_ACCESS_TOKEN)
-
-    # Get all repositories from GitHub except repos starting with restricted prefix
-    source_repos = g.get_user().get_repos()
-    source_repos = [
-        repo for repo in source_repos if not repo.name.startswith(RESTRICTED_PREFIX)
-        and repo.name.startswith("t")
-    ]
-    logging.info(f"{len(source_repos)} repositories found in GitHub.")
+    async with aiohttp.ClientSession(
+        auth=aiohttp.BasicAuth("", DESTINATION_PERSONAL_ACCESS_TOKEN),
+        headers={"Content-Type": "application/json"},
+    ) as session:
+        # List both platforms at once; PyGithub is synchronous, so it runs in a thread
+        source_repos, destination_repos = await asyncio.gather(
+            asyncio.to_thread(list_github_repositories),
+            list_ado_repositories(session, DESTINATION_ORG, DESTINATION_PROJECT),
+        )
+        logging.info(f"{len(source_repos)} repositories found in GitHub.")
+        logging.info(f"{len(destination_repos)} repositories found in ADO.")
 
-    # Get all repositories from destination platform
-    destination_repos = list_ado_repositories(DESTINATION_ORG, DESTINATION_PROJECT)
-    logging.info(f"{len(destination_repos)} repositories found in ADO.")
+        # Find new repositories on GitHub that do not exist on destination platform
+        new_repos = [repo for repo in source_repos if repo.name not in destination_repos]
+        logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
 
-    # Find new repositories on GitHub that do not exist on destination platform
-    new_repos = [repo for repo in source_repos if repo.name not in destination_repos]
+        # Pull latest changes from existing repositories and push to destination platform
+        existing_repos = [
+            repo for repo in source_repos if repo.name in destination_repos
+        ]
+        logging.info(f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub.")
 
-    # Create new repositories on destination platform and push changes from Github
-    logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
+        # Bound the in-flight create requests to stay within ADO rate limits
+        create_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+        sync_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SYNCS)
 
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(
-                create_ado_repository, DESTINATION_ORG, DESTINATION_PROJECT, repo.name
-            )
+        # New repositories are mirrored as soon as their own create finishes, while
+        # existing repositories are synchronized alongside them
+        tasks = [
+            create_and_push(session, create_semaphore, sync_semaphore, repo.name)
             for repo in new_repos
         ]
-        futures += [executor.submit(clone_and_push, repo.name) for repo in new_repos]
-
-        for future in futures:
-            repo_name, error = future.result()
-            if error:
-                print(f"Error: Task failed with exception: {error} for repository: {repo_name}")
-
-    # Pull latest changes from main/master branch of existing repositories and push to destination platform
-    existing_repos = [
-        repo for repo in source_repos if repo.name in destination_repos
-    ]
-    logging.info(f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub.")
-
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(synchronize_and_push, repo.name) for repo in existing_repos
+        tasks += [
+            mirror_and_push(sync_semaphore, repo.name) for repo in existing_repos
         ]
-
-        for future in futures:
-            repo_name, error = future.result()
+        for task in asyncio.as_completed(tasks):
+            repo_name, error = await task
             if error:
                 print(f"Error: Task failed with exception: {error} for repository: {repo_name}")
-    exec_time = time.gmtime(time.time() - start_time)
+
+    exec_hours, exec_seconds = divmod(int(time.time() - start_time), 3600)
+    exec_minutes, exec_seconds = divmod(exec_seconds, 60)
 
     logging.info(
-        f"Synchronization time: {exec_time.tm_hour}h {exec_time.tm_min}m {exec_time.tm_sec}s"
+        f"Synchronization time: {exec_hours}h {exec_minutes}m {exec_seconds}s"
     )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -1,12 +1,13 @@
 import os
-import subprocess
-import shutil
+import asyncio
 from github import Github
-from git import Repo
+import pygit2
 import json
+import orjson
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import time
+import aiohttp
 
 SOURCE_URL = "https://github.com"
 DESTINATION_URL = "https://dev.azure.com"
@@ -18,211 +19,229 @@ DESTINATION_PERSONAL_ACCESS_TOKEN = os.environ["ADO_PERSONAL_ACCESS_TOKEN"]
 RESTRICTED_PREFIX = "restricted"
 ASSET_PREFIX = "asset"
 LOCAL_PATH = os.environ["RUNNER_TEMP"]
+MIRROR_PATH = os.path.join(os.path.dirname(LOCAL_PATH), "cache", "mirrors")
+MAX_CONCURRENT_SYNCS = 16
+MAX_CONCURRENT_CREATES = 8
 
-logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
-
+# Reuse one GitHub client for every API call
+GITHUB_CLIENT = Github(PERSONAL_ACCESS_TOKEN, per_page=100, retry=3)
 
-def create_ado_repository(org_name: str, project_name: str, repo_name: str) -> None:
-    # Create the repository
-    cmd = [
-        "az",
-        "repos",
-        "create",
-        "--org",
-        f"https://dev.azure.com/{org_name}",
-        "--project",
-        project_name,
-        "--name",
-        repo_name,
-        "--output",
-        "table",
-    ]
-    subprocess.run(cmd, check=True)
+logging.basicConfig(format="[%(levelname)s] %(message)s", level=logging.INFO)
 
 
-def list_ado_repositories(org_name: str, project_name: str) -> list:
-    destination_repos = []
-    cmd = (
-        f"az repos list --org https://dev.azure.com/{org_name} --project {project_name}"
-    )
-    output = os.popen(cmd).read()
-    repos = json.loads(output)
+async def create_ado_repository(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    org_name: str,
+    project_name: str,
+    repo_name: str,
+) -> None:
+    url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
+    data = {"name": repo_name}
+    async with semaphore:
+        async with session.post(url, data=json.dumps(data)) as response:
+            response.raise_for_status()
+
+
+async def list_ado_repositories(
+    session: aiohttp.ClientSession, org_name: str, project_name: str
+) -> set:
+    destination_repos = set()
+    url = f"https://dev.azure.com/{org_name}/{project_name}/_apis/git/repositories?api-version=6.0"
+    async with session.get(url) as response:
+        response.raise_for_status()
+        repos = orjson.loads(await response.read())["value"]
     for repo in repos:
-        destination_repos.append(repo["name"])
+        destination_repos.add(repo["name"])
     return destination_repos
 
 
-def get_default_branch(repo_name: str) -> str:
-    g = Github(PERSONAL_ACCESS_TOKEN)
-    repo = g.get_repo(f"{SOURCE_USER}/{repo_name}")
-    return repo.default_branch
-
-
-def clone_and_push(repo_name: str) -> tuple:
-    try:
-        logging.info(f"Cloning repo: {repo_name} started.")
-        default_branch = get_default_branch(repo_name)
-        if default_branch is None:
-            logging.info(f"Skipping empty repo: {repo_name}")
-            return (repo_name, None)
-        # Clone only the latest version of the default branch from Github
-        clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
-        repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
-
-        # Check if repo_path already exists and is not empty
-        if os.path.exists(repo_path) and os.listdir(repo_path):
-            # Delete the existing directory and its contents
-            shutil.rmtree(repo_path)
-
-        repo = Repo.clone_from(clone_url, repo_path, branch=default_branch, depth=1)
-
-        # Remove history and initialize new repo
-        shutil.rmtree(os.path.join(repo_path, ".git"))
-        Repo.init(repo_path)
-
-        # Make an initial commit
-        repo.index.add("*")
-
-        hidden_files = [file for file in repo.untracked_files if file.startswith(".")]
-        if hidden_files:
-            repo.index.add(hidden_files)
-        else:
-            print("No hidden files found")
-        repo.index.commit("Initial commit")
-
-        # Push to destination
-        remote_name = "destination"
-        remote_url = f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
-        remote_url_with_token = remote_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
-        )
-
-        repo.create_remote(remote_name, url=remote_url_with_token)
+def list_github_repositories() -> list:
+    # Get all repositories from GitHub except repos starting with restricted prefix
+    source_repos = GITHUB_CLIENT.get_user().get_repos()
+    return [
+        repo
+        for repo in source_repos
+        if not repo.name.startswith(RESTRICTED_PREFIX)
+        and repo.name.startswith("skills")
+    ]
 
-        # repo.create_remote(remote_name, url=remote_url_with_token)
-        repo.git.push(remote_name, f"HEAD:refs/heads/{default_branch}", force=True)
 
-        # Clean up
-        shutil.rmtree(repo_path)
-        logging.info(f"Cloning repo: {repo_name} complete.")
-        return (repo_name, None)
-    except Exception as e:
-        logging.error(f"Error cloning repo: {repo_name}. Exception: {e}")
-        return (repo_name, e)
+class DestinationCallbacks(pygit2.RemoteCallbacks):
+    def push_update_reference(self, refname: str, message: str) -> None:
+        # libgit2 reports rejected refs here instead of failing the push
+        if message is not None:
+            raise pygit2.GitError(f"Push of {refname} rejected: {message}")
 
 
-def synchronize_and_push(repo_name: str) -> tuple:
+def synchronize_and_push(repo_name: str, default_branch: str) -> tuple:
     try:
         logging.info(f"Synchronization of repo: {repo_name} started.")
-        default_branch = get_default_branch(repo_name)
-        # Set up source and destination repository URLs
+        if default_branch is None:
+            logging.info(f"Skipping empty repo: {repo_name}")
+            return (repo_name, None)
+        # Set up source and destination repository URLs; credentials are
+        # supplied by the remote callbacks rather than embedded in the URL
         source_clone_url = f"{SOURCE_URL}/{SOURCE_USER}/{repo_name}.git"
         destination_clone_url = f"{DESTINATION_URL}/{DESTINATION_ORG}/{DESTINATION_PROJECT}/_git/{repo_name}"
-        destination_clone_url_with_token = destination_clone_url.replace(
-            "https://", f"https://{DESTINATION_PERSONAL_ACCESS_TOKEN}@"
+        source_callbacks = pygit2.RemoteCallbacks(
+            credentials=pygit2.UserPass("x-access-token", PERSONAL_ACCESS_TOKEN)
+        )
+        destination_callbacks = DestinationCallbacks(
+            credentials=pygit2.UserPass("", DESTINATION_PERSONAL_ACCESS_TOKEN)
         )
 
-        # Set up temporary repository path
-        tmp_repo_path = f"{LOCAL_PATH}/tempdir/{repo_name}"
-        if os.path.exists(tmp_repo_path):
-            shutil.rmtree(tmp_repo_path)
-
-        # Clone source repository
-        Repo.clone_from(source_clone_url, tmp_repo_path, branch=default_branch, depth=1)
-
-        # Remove history and initialize new repository
-        shutil.rmtree(os.path.join(tmp_repo_path, ".git"))
-        tmp_repo = Repo.init(tmp_repo_path)
+        # Reuse the bare mirror from earlier runs so only new objects are transferred
+        mirror_path = f"{MIRROR_PATH}/{repo_name}.git"
+        if os.path.exists(mirror_path):
+            mirror = pygit2.Repository(mirror_path)
+            mirror.remotes.set_url("origin", source_clone_url)
+            mirror.remotes.set_url("destination", destination_clone_url)
+        else:
+            mirror = pygit2.init_repository(mirror_path, bare=True)
+            mirror.remotes.create("origin", source_clone_url)
+            mirror.remotes.create("destination", destination_clone_url)
+        destination = mirror.remotes["destination"]
+
+        # Fetch the source branch
+        mirror.remotes["origin"].fetch(
+            [f"+refs/heads/{default_branch}:refs/heads/{default_branch}"],
+            callbacks=source_callbacks,
+        )
 
-        # Make an initial commit
-        tmp_repo.git.add(A=True)
-        tmp_repo.index.commit("Update from GitHub")
+        # Fetch what destination already has, so the push only sends new objects
+        # and the lease check below knows the current destination tip
+        destination_ref = f"refs/remotes/destination/{default_branch}"
+        # Drop the tip left by an earlier run, in case the branch was deleted since
+        if destination_ref in mirror.references:
+            mirror.references.delete(destination_ref)
+        try:
+            destination.fetch(
+                [f"+refs/heads/{default_branch}:{destination_ref}"],
+                callbacks=destination_callbacks,
+            )
+        except pygit2.GitError as e:
+            logging.warning(f"Failed to fetch {default_branch} from destination: {e}")
+        expected_oid = (
+            mirror.references[destination_ref].target
+            if destination_ref in mirror.references
+            else None
+        )
 
-        # Add destination remote
-        tmp_repo.create_remote("destination", url=destination_clone_url_with_token)
+        # libgit2 has no --force-with-lease, so refuse to overwrite a destination
+        # branch that moved since it was fetched
+        destination_heads = {
+            head["name"]: head["oid"]
+            for head in destination.ls_remotes(callbacks=destination_callbacks)
+        }
+        if destination_heads.get(f"refs/heads/{default_branch}") != expected_oid:
+            raise RuntimeError(
+                f"Destination branch {default_branch} changed since it was fetched"
+            )
 
         # Push changes to destination
-        tmp_repo.remotes.destination.push(
-            f"HEAD:refs/heads/{default_branch}", force=True
+        destination.push(
+            [f"+refs/heads/{default_branch}:refs/heads/{default_branch}"],
+            callbacks=destination_callbacks,
         )
 
-        # Clean up
-        shutil.rmtree(tmp_repo_path)
         logging.info(f"Synchronization of repo: {repo_name} complete.")
         return (repo_name, None)
     except Exception as e:
         return (repo_name, e)
 
 
-def main():
-    start_time = time.time()
-    logging.debug(f"Started cloning/syncing at {start_time}")
-
-    g = Github(PERSONAL_ACCESS_TOKEN)
-
-    # Get all repositories from GitHub except repos starting with restricted prefix
-    source_repos = g.get_user().get_repos()
-    source_repos = [
-        repo
-        for repo in source_repos
-        if not repo.name.startswith(RESTRICTED_PREFIX)
-        and repo.name.startswith("skills")
-    ]
-    logging.info(f"{len(source_repos)} repositories found in GitHub.")
+async def create_and_synchronize(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    executor: ThreadPoolExecutor,
+    repo_name: str,
+    default_branch: str,
+) -> tuple:
+    try:
+        await create_ado_repository(
+            session, semaphore, DESTINATION_ORG, DESTINATION_PROJECT, repo_name
+        )
+    except aiohttp.ClientError as e:
+        return (repo_name, e)
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, synchronize_and_push, repo_name, default_branch
+    )
 
-    # Get all repositories from destination platform
-    destination_repos = list_ado_repositories(DESTINATION_ORG, DESTINATION_PROJECT)
-    logging.info(f"{len(destination_repos)} repositories found in ADO.")
 
-    # Find new repositories on GitHub that do not exist on destination platform
-    new_repos = [repo for repo in source_repos if repo.name not in destination_repos]
+async def main():
+    start_time = time.time()
+    logging.debug(f"Started cloning/syncing at {start_time}")
 
-    # Create new repositories on destination platform and push changes from Github
-    logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
+    async with aiohttp.ClientSession(
+        auth=aiohttp.BasicAuth("", DESTINATION_PERSONAL_ACCESS_TOKEN),
+        headers={"Content-Type": "application/json"},
+    ) as session:
+        # List both platforms at once; PyGithub is synchronous, so it runs in a thread
+        source_repos, destination_repos = await asyncio.gather(
+            asyncio.to_thread(list_github_repositories),
+            list_ado_repositories(session, DESTINATION_ORG, DESTINATION_PROJECT),
+        )
+        logging.info(f"{len(source_repos)} repositories found in GitHub.")
+        logging.info(f"{len(destination_repos)} repositories found in ADO.")
+        default_branches = {repo.name: repo.default_branch for repo in source_repos}
 
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(
-                create_ado_repository, DESTINATION_ORG, DESTINATION_PROJECT, repo.name
-            )
-            for repo in new_repos
+        # Find new repositories on GitHub that do not exist on destination platform
+        new_repos = [
+            repo for repo in source_repos if repo.name not in destination_repos
         ]
-        futures += [executor.submit(clone_and_push, repo.name) for repo in new_repos]
-
-        for future in futures:
-            result = future.result()
-            if result is not None:
-                repo_name, error = result
-                if error:
-                    print(
-                        f"Error: Task failed with exception: {error} for repository: {repo_name}"
-                    )
+        logging.info(f"{len(new_repos)} repositories need to be created in ADO.")
 
-    # Pull latest changes from main/master branch of existing repositories and push to destination platform
-    existing_repos = [repo for repo in source_repos if repo.name in destination_repos]
-    logging.info(
-        f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub."
-    )
-
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(synchronize_and_push, repo.name) for repo in existing_repos
+        # Pull latest changes from main/master branch of existing repositories and push to destination platform
+        existing_repos = [
+            repo for repo in source_repos if repo.name in destination_repos
         ]
-        for future in futures:
-            result = future.result()
-            if result is not None:
-                repo_name, error = result
+        logging.info(
+            f"{len(existing_repos)} repositories in ADO will be synchronized with GitHub."
+        )
+
+        # Bound the in-flight create requests to stay within ADO rate limits
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+        loop = asyncio.get_running_loop()
+
+        # pygit2 is blocking, so each synchronization runs on its own worker thread;
+        # libgit2 releases the GIL during network transfers
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SYNCS) as executor:
+            # New repositories are synchronized as soon as their own create
+            # finishes, while existing repositories are synchronized alongside them
+            tasks = [
+                create_and_synchronize(
+                    session,
+                    semaphore,
+                    executor,
+                    repo.name,
+                    default_branches[repo.name],
+                )
+                for repo in new_repos
+            ]
+            tasks += [
+                loop.run_in_executor(
+                    executor,
+                    synchronize_and_push,
+                    repo.name,
+                    default_branches[repo.name],
+                )
+                for repo in existing_repos
+            ]
+            for task in asyncio.as_completed(tasks):
+                repo_name, error = await task
                 if error:
                     print(
                         f"Error: Task failed with exception: {error} for repository: {repo_name}"
                     )
 
-    exec_time = time.gmtime(time.time() - start_time)
+    exec_hours, exec_seconds = divmod(int(time.time() - start_time), 3600)
+    exec_minutes, exec_seconds = divmod(exec_seconds, 60)
 
-    sync_time = f"Synchronization time: {exec_time.tm_hour}h {exec_time.tm_min}m {exec_time.tm_sec}s"
+    sync_time = f"Synchronization time: {exec_hours}h {exec_minutes}m {exec_seconds}s"
     logging.info(sync_time)
     print(sync_time, file=open("$GITHUB_OUTPUT", "a"))
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())